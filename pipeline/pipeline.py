@@ -1,4 +1,6 @@
 import luigi
+import tracemalloc
+from collections import Counter
 import pandas as pd
 from pathlib import Path
 from pipeline_utils import (
@@ -6,15 +8,54 @@ from pipeline_utils import (
     calculate_variance,
     calculate_disbursed,
     refine_merged_df,
+    build_shared_paycodes,
+    combine_employer_frames,
+    read_excel_sheet_sharded,
+    validate_super_data,
+    Severity,
+    GROUP_BY_CRITERIA,
+    TENANT_GROUP_BY_CRITERIA,
+    VALIDATION_SAMPLE_ROWS,
 )
 
 RAW_DATA_DIR = "data/raw"
 EXTRACTED_DATA_DIR = "data/extracted"
 METRICS_DIR = "metrics"
 METRICS_FILE = "metrics.csv"
+TENANT_METRICS_FILE = "tenant_metrics.csv"
 PAYSLIPS_FILE = "Payslips.csv"
 DISBURSEMENTS_FILE = "Disbursements.csv"
 PAYCODES_FILE = "PayCodes.csv"
+VIOLATIONS_FILE = "violations.csv"
+
+
+def write_metrics(
+    merged_df: pd.DataFrame,
+    output_path: str,
+    group_by: list = GROUP_BY_CRITERIA,
+    trace_memory: bool = False,
+) -> pd.DataFrame:
+    """Refine the merged metrics and write them as CSV and Excel files.
+
+    When trace_memory is set, the peak memory traced by tracemalloc during
+    this output stage is reported. Tracing slows the Excel export down
+    considerably, so it is off by default. A tracer that is already running
+    is left running and its peak is reported instead.
+    """
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        merged_df = refine_merged_df(merged_df, group_by=group_by)
+        merged_df.to_csv(output_path, index=False)
+        merged_df.to_excel(output_path.replace(".csv", ".xlsx"), index=False)
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            print(f"Peak memory during output: {peak_memory / 2**20:.2f} MiB")
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return merged_df
 
 
 class ConvertExcelToCSV(luigi.Task):
@@ -23,6 +64,9 @@ class ConvertExcelToCSV(luigi.Task):
     Attributes:
         source_file (luigi.Parameter): The path to the source Excel file.
         target_directory (luigi.Parameter): The directory where the CSV files will be saved.
+        ingest_processes (luigi.IntParameter): The number of processes parsing
+            row ranges of each sheet in parallel. Defaults to 1, reading
+            each sheet with pandas in the current process.
     Methods:
         output(): Specifies the output targets for the task.
         run(): Reads the specified sheets from the Excel file and writes them as CSV files to the target directory.
@@ -30,6 +74,7 @@ class ConvertExcelToCSV(luigi.Task):
 
     source_file = luigi.Parameter()
     target_directory = luigi.Parameter()
+    ingest_processes = luigi.IntParameter(default=1)
 
     def output(self):
         return [
@@ -38,16 +83,20 @@ class ConvertExcelToCSV(luigi.Task):
             luigi.LocalTarget(f"{self.target_directory}/{PAYCODES_FILE}"),
         ]
 
+    def _read_sheet(self, sheet_name: str) -> pd.DataFrame:
+        if self.ingest_processes > 1:
+            return read_excel_sheet_sharded(
+                self.source_file, sheet_name, processes=self.ingest_processes
+            )
+        return pd.read_excel(self.source_file, sheet_name=sheet_name)
+
     def run(self):
-        disbursements_df = pd.read_excel(
-            self.source_file, sheet_name=DISBURSEMENTS_FILE.replace(".csv", "")
-        )
-        payslips_df = pd.read_excel(
-            self.source_file, sheet_name=PAYSLIPS_FILE.replace(".csv", "")
-        )
-        paycodes_df = pd.read_excel(
-            self.source_file, sheet_name=PAYCODES_FILE.replace(".csv", "")
+        Path(self.target_directory).mkdir(parents=True, exist_ok=True)
+        disbursements_df = self._read_sheet(
+            DISBURSEMENTS_FILE.replace(".csv", "")
         )
+        payslips_df = self._read_sheet(PAYSLIPS_FILE.replace(".csv", ""))
+        paycodes_df = self._read_sheet(PAYCODES_FILE.replace(".csv", ""))
         disbursements_df.to_csv(self.output()[0].path, index=False)
         payslips_df.to_csv(self.output()[1].path, index=False)
         paycodes_df.to_csv(self.output()[2].path, index=False)
@@ -55,6 +104,75 @@ class ConvertExcelToCSV(luigi.Task):
         print("CSV files have been created successfully.")
 
 
+class ValidateExtractedData(luigi.Task):
+    """
+    Luigi Task to validate the extracted CSV files before calculating the
+    metrics.
+
+    The checks run on the first rows of the payslips and disbursements
+    first, so a malformed file fails without reading it in full, and then
+    on the whole files. The violations found are written to a report
+    next to the CSV files, and the task fails if any of them is an error.
+    A failure also removes the extracted CSV files, so the next run
+    extracts them again from the corrected Excel file.
+
+    Attributes:
+        source_file (luigi.Parameter): The path to the source Excel file.
+        target_directory (luigi.Parameter): The directory where the CSV files are extracted.
+        sample_rows (luigi.IntParameter): The number of rows checked before
+            the whole files.
+    """
+
+    source_file = luigi.Parameter()
+    target_directory = luigi.Parameter()
+    sample_rows = luigi.IntParameter(default=VALIDATION_SAMPLE_ROWS)
+
+    def requires(self):
+        return ConvertExcelToCSV(
+            source_file=self.source_file,
+            target_directory=self.target_directory,
+        )
+
+    def output(self):
+        return luigi.LocalTarget(f"{self.target_directory}/{VIOLATIONS_FILE}")
+
+    def complete(self):
+        # a report listing errors is kept for inspection, but the data it
+        # describes must be validated again before it can be used
+        if not self.output().exists():
+            return False
+        violations = pd.read_csv(self.output().path)
+        return not (violations["severity"] == Severity.ERROR.value).any()
+
+    def _read(self, file_name: str, nrows: int = None) -> pd.DataFrame:
+        return pd.read_csv(f"{self.target_directory}/{file_name}", nrows=nrows)
+
+    def run(self):
+        pay_codes = self._read(PAYCODES_FILE)
+        for nrows in (self.sample_rows, None):
+            payslips = self._read(PAYSLIPS_FILE, nrows)
+            disbursements = self._read(DISBURSEMENTS_FILE, nrows)
+            violations = validate_super_data(
+                payslips, disbursements, pay_codes
+            )
+            errors = violations["severity"] == Severity.ERROR.value
+            # stop at the sample when it fails or already holds every row
+            if errors.any() or (
+                len(payslips) < self.sample_rows
+                and len(disbursements) < self.sample_rows
+            ):
+                break
+        violations.to_csv(self.output().path, index=False)
+        if errors.any():
+            for extracted in self.input():
+                extracted.remove()
+            raise ValueError(
+                f"{violations.loc[errors, 'count'].sum()} invalid values "
+                f"found, see {self.output().path}"
+            )
+        print("Extracted data has been validated successfully.")
+
+
 class CalculateMetrics(luigi.Task):
     """
     A Luigi Task to calculate metrics from raw data.
@@ -62,6 +180,8 @@ class CalculateMetrics(luigi.Task):
     Attributes:
         base_path (luigi.Parameter): The base directory path where data is stored.
         excel_super_data (luigi.Parameter): The name of the Excel file containing the super data.
+        trace_output_memory (luigi.BoolParameter): Whether to report the
+            peak memory traced while writing the metrics. Defaults to False.
 
     Methods:
         requires(): Specifies the task dependencies.
@@ -69,7 +189,8 @@ class CalculateMetrics(luigi.Task):
         run(): Executes the task to calculate metrics and save the results.
 
     Requires:
-        ConvertExcelToCSV: A task to convert the Excel file to CSV format.
+        ValidateExtractedData: A task to validate the CSV files converted
+            from the Excel file.
 
     Outputs:
         A CSV file and an Excel file containing the calculated metrics.
@@ -79,12 +200,13 @@ class CalculateMetrics(luigi.Task):
     """
     base_path = luigi.Parameter()
     excel_super_data = luigi.Parameter()
+    trace_output_memory = luigi.BoolParameter(default=False)
 
     def requires(self):
         source_file = (
             f"{self.base_path}/{RAW_DATA_DIR}/{self.excel_super_data}"
         )
-        return ConvertExcelToCSV(
+        return ValidateExtractedData(
             source_file=source_file,
             target_directory=f"{self.base_path}/{EXTRACTED_DATA_DIR}",
         )
@@ -109,14 +231,119 @@ class CalculateMetrics(luigi.Task):
         # calculate the variance based on ote_super and disbursed
         merged_df = calculate_variance(ote_super, disbursed)
         print("Merged data: ", merged_df)
-        merged_df = refine_merged_df(merged_df)
-        merged_df.to_csv(self.output().path, index=False)
-        merged_df.to_excel(
-            self.output().path.replace(".csv", ".xlsx"), index=False
+        write_metrics(
+            merged_df,
+            self.output().path,
+            trace_memory=self.trace_output_memory,
         )
         print("Metrics have been calculated and saved successfully.")
 
 
+class CalculateTenantMetrics(luigi.Task):
+    """
+    A Luigi Task to calculate the metrics of many employers in one pass.
+
+    Each employer's Excel file is extracted into its own directory and
+    validated, then the payslips, disbursements and paycodes of all
+    employers are combined with an employer_id column and processed
+    together, grouped by TENANT_GROUP_BY_CRITERIA. The paycodes are held
+    in one shared, deduplicated lookup table. Only the metrics are
+    batched; extraction and validation are still one task per employer.
+
+    Attributes:
+        base_path (luigi.Parameter): The base directory path where data is stored.
+        excel_super_data_files (luigi.ListParameter): The names of the Excel
+            files, one per employer. The file name without its extension is
+            used as the employer_id, so it must be unique.
+        trace_output_memory (luigi.BoolParameter): Whether to report the
+            peak memory traced while writing the metrics. Defaults to False.
+
+    Outputs:
+        A CSV file and an Excel file containing the calculated metrics of
+        every employer.
+
+    Example:
+        luigi.build([CalculateTenantMetrics(base_path='/path/to/base',
+                     excel_super_data_files=['a.xlsx', 'b.xlsx'])])
+    """
+    base_path = luigi.Parameter()
+    excel_super_data_files = luigi.ListParameter()
+    trace_output_memory = luigi.BoolParameter(default=False)
+
+    def requires(self):
+        employer_ids = [
+            Path(excel_super_data).stem
+            for excel_super_data in self.excel_super_data_files
+        ]
+        duplicated_ids = sorted(
+            employer_id
+            for employer_id, count in Counter(employer_ids).items()
+            if count > 1
+        )
+        if duplicated_ids:
+            raise ValueError(
+                f"Excel files share the employer_id {duplicated_ids}"
+            )
+        return {
+            employer_id: ValidateExtractedData(
+                source_file=(
+                    f"{self.base_path}/{RAW_DATA_DIR}/{excel_super_data}"
+                ),
+                target_directory=(
+                    f"{self.base_path}/{EXTRACTED_DATA_DIR}/{employer_id}"
+                ),
+            )
+            for employer_id, excel_super_data in zip(
+                employer_ids, self.excel_super_data_files
+            )
+        }
+
+    def output(self):
+        return luigi.LocalTarget(
+            f"{self.base_path}/{METRICS_DIR}/{TENANT_METRICS_FILE}"
+        )
+
+    @staticmethod
+    def _read_extracted(validate_tasks: dict, file_name: str) -> dict:
+        return {
+            employer_id: pd.read_csv(
+                f"{validate_task.target_directory}/{file_name}"
+            )
+            for employer_id, validate_task in validate_tasks.items()
+        }
+
+    def run(self):
+        validate_tasks = self.requires()
+        pay_codes = build_shared_paycodes(
+            self._read_extracted(validate_tasks, PAYCODES_FILE)
+        )
+        payslips = combine_employer_frames(
+            self._read_extracted(validate_tasks, PAYSLIPS_FILE), pay_codes
+        )
+        disbursements = combine_employer_frames(
+            self._read_extracted(validate_tasks, DISBURSEMENTS_FILE)
+        )
+        ote_super = calculate_ote_and_super(
+            payslips, pay_codes, group_by=TENANT_GROUP_BY_CRITERIA
+        )
+        disbursed = calculate_disbursed(
+            disbursements, group_by=TENANT_GROUP_BY_CRITERIA
+        )
+        merged_df = calculate_variance(
+            ote_super, disbursed, group_by=TENANT_GROUP_BY_CRITERIA
+        )
+        write_metrics(
+            merged_df,
+            self.output().path,
+            group_by=TENANT_GROUP_BY_CRITERIA,
+            trace_memory=self.trace_output_memory,
+        )
+        print(
+            f"Metrics of {len(self.excel_super_data_files)} employers have "
+            "been calculated and saved successfully."
+        )
+
+
 if __name__ == "__main__":
     base_path = Path(
         input(
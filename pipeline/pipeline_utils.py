@@ -1,6 +1,23 @@
+import calendar
+import os
+import re
+import zipfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from io import BytesIO
+import numpy as np
 import pandas as pd
 from enum import Enum
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+# ExcelReader's individual read steps, apply_stylesheet, WorkSheetParser and
+# Workbook._date_formats used to read sheet shards are openpyxl internals;
+# they rely on the pinned openpyxl==3.1.0
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.worksheet._reader import WorkSheetParser
+from pandas.io.parsers import TextParser
 
 # Define the quarter periods
 QUARTERS = {
@@ -21,9 +38,56 @@ QUARTERS = {
         "payment_end": "01-28",
     },
 }
-OTE_SUPER_RATE = 0.095
+# QuarterCalendar lays the windows out on a leap year; February 29 is its
+# zero-based day 59
+LEAP_TEMPLATE_YEAR = 2000
+LEAP_DAY = 59
+# Superannuation guarantee rate keyed by the date it takes effect
+SUPER_RATE_SCHEDULE = {
+    "2002-07-01": 0.09,
+    "2013-07-01": 0.0925,
+    "2014-07-01": 0.095,
+    "2021-07-01": 0.10,
+    "2022-07-01": 0.105,
+    "2023-07-01": 0.11,
+    "2024-07-01": 0.115,
+    "2025-07-01": 0.12,
+}
 GROUP_BY_CRITERIA = ["employee_code", "year", "quarter"]
+EMPLOYER_ID = "employer_id"
+TENANT_GROUP_BY_CRITERIA = [EMPLOYER_ID] + GROUP_BY_CRITERIA
 ROUNDING_PRECISION = 2
+# Fewest rows worth handing to a separate process when sharding a sheet
+MIN_SHARD_ROWS = 50_000
+# Size of the decompressed chunks scanned for the rows of a sheet
+SHEET_SCAN_CHUNK_SIZE = 1 << 20
+_ROW_TAG = re.compile(rb"<(?:\w+:)?row[\s/>]")
+_START_TAG = re.compile(rb"<([\w:]+)[\s/>]")
+_SHEET_DATA_START_TAG = re.compile(rb"<((?:\w+:)?sheetData)[\s>]")
+_SHEET_DATA_END_TAG = re.compile(rb"</(?:\w+:)?sheetData>")
+# Longest tag prefix that may straddle two scanned chunks
+_TAG_OVERLAP = 64
+# Columns each extracted table must provide, and those that may not be null
+REQUIRED_COLUMNS = {
+    "payslips": ["employee_code", "code", "amount", "end"],
+    "disbursements": ["employee_code", "payment_made", "sgc_amount"],
+    "paycodes": ["pay_code", "ote_treament"],
+}
+KEY_COLUMNS = {
+    "payslips": ["employee_code", "code", "end"],
+    "disbursements": ["employee_code", "payment_made"],
+    "paycodes": ["pay_code"],
+}
+DATE_FORMATS = {
+    "payslips": {"end": "%Y-%m-%d"},
+    "disbursements": {"payment_made": "%Y-%m-%dT%H:%M:%S"},
+}
+AMOUNT_COLUMNS = {
+    "payslips": ["amount"],
+    "disbursements": ["sgc_amount"],
+}
+VALIDATION_SAMPLE_ROWS = 10_000
+VIOLATION_EXAMPLES = 5
 
 
 class Quarter(Enum):
@@ -33,11 +97,201 @@ class Quarter(Enum):
     Q4 = "Q4"
 
 
+class Severity(Enum):
+    # errors stop the pipeline, warnings are only reported
+    ERROR = "error"
+    WARNING = "warning"
+
+
 def read_csv(file_path: str) -> pd.DataFrame:
     """Read a CSV file and return a pandas DataFrame."""
     return pd.read_csv(file_path)
 
 
+def _convert_cell(value, data_type: str):
+    """Convert a cell value the same way pandas.read_excel does."""
+    if value is None:
+        return ""
+    elif data_type == TYPE_ERROR:
+        return np.nan
+    elif data_type == TYPE_NUMERIC:
+        if int(value) == value:
+            return int(value)
+        return float(value)
+    return value
+
+
+def _open_workbook(source_file: str, sheet_name: str) -> tuple:
+    """Read what parsing a sheet needs (shared strings, date formats and
+    the sheet's path in the archive) without loading any worksheet, which
+    in read-only mode may scan every sheet for its dimensions."""
+    reader = ExcelReader(source_file, read_only=True, data_only=True)
+    reader.read_manifest()
+    reader.read_strings()
+    reader.read_workbook()
+    apply_stylesheet(reader.archive, reader.wb)
+    members = {
+        sheet.name: rel.target for sheet, rel in reader.parser.find_sheets()
+    }
+    if sheet_name not in members:
+        reader.archive.close()
+        raise ValueError(f"Worksheet named '{sheet_name}' not found")
+    return reader, members[sheet_name]
+
+
+def _scan_sheet_rows(archive: zipfile.ZipFile, member: str) -> tuple:
+    """Return the byte offsets of the <row> elements of a worksheet in its
+    decompressed XML, and the offset where its sheetData element ends."""
+    row_offsets = array("q")
+    buffer = b""
+    buffer_offset = 0
+    with archive.open(member) as source:
+        while True:
+            chunk = source.read(SHEET_SCAN_CHUNK_SIZE)
+            buffer += chunk
+            sheet_data_end = _SHEET_DATA_END_TAG.search(buffer)
+            if sheet_data_end:
+                limit = sheet_data_end.start()
+            elif chunk:
+                # a tag may straddle two chunks, so the tail of the buffer
+                # is searched again together with the next chunk
+                limit = max(len(buffer) - _TAG_OVERLAP, 0)
+            else:
+                limit = len(buffer)
+            row_offsets.extend(
+                buffer_offset + row.start()
+                for row in _ROW_TAG.finditer(buffer, 0, limit + _TAG_OVERLAP)
+                if row.start() < limit
+            )
+            if sheet_data_end:
+                return row_offsets, buffer_offset + limit
+            if not chunk:
+                if row_offsets:
+                    raise ValueError(f"{member} has no end of sheetData")
+                return row_offsets, None
+            buffer = buffer[limit:]
+            buffer_offset += limit
+
+
+def _read_sheet_shard(
+    source_file: str,
+    sheet_name: str,
+    prefix: bytes,
+    suffix: bytes,
+    start: int,
+    end: int,
+    rows_before: int,
+) -> list:
+    """Parse the rows between two byte offsets of a worksheet's XML into
+    (row number, converted values) pairs, with trailing empty values
+    trimmed as pandas.read_excel does."""
+    reader, member = _open_workbook(source_file, sheet_name)
+    with reader.archive as archive, archive.open(member) as source:
+        source.seek(start)
+        fragment = source.read(end - start)
+    # the fragment is wrapped in the worksheet's own opening and closing
+    # tags so the parser sees a complete document
+    parser = WorkSheetParser(
+        BytesIO(prefix + fragment + suffix),
+        reader.shared_strings,
+        data_only=True,
+        epoch=reader.wb.epoch,
+        date_formats=reader.wb._date_formats,
+    )
+    # rows without an 'r' attribute are numbered from the rows before them
+    parser.row_counter = rows_before
+    rows = []
+    for row_number, cells in parser.parse():
+        row = []
+        for cell in cells:
+            value = _convert_cell(cell["value"], cell["data_type"])
+            if cell["column"] > len(row):
+                row.extend([""] * (cell["column"] - 1 - len(row)))
+                row.append(value)
+            else:
+                row[cell["column"] - 1] = value
+        while row and row[-1] == "":
+            row.pop()
+        rows.append((row_number, row))
+    return rows
+
+
+def read_excel_sheet_sharded(
+    source_file: str,
+    sheet_name: str,
+    processes: int = None,
+    min_shard_rows: int = MIN_SHARD_ROWS,
+) -> pd.DataFrame:
+    """
+    Read an Excel sheet by parsing row ranges of it in parallel.
+
+    The sheet's XML is scanned once for the byte offset of every row, and
+    the rows are split into up to `processes` contiguous ranges of at
+    least `min_shard_rows` rows. Each worker process decompresses the
+    sheet up to its range and parses only the rows in it. The raw values
+    are then assembled in order and their dtypes are inferred once over
+    the whole sheet, giving the same result as pandas.read_excel.
+
+    Args:
+        source_file (str): The path to the Excel file.
+        sheet_name (str): The name of the sheet to read.
+        processes (int): The maximum number of worker processes. Defaults
+                         to the number of CPUs.
+        min_shard_rows (int): The fewest rows given to a worker.
+
+    Returns:
+        pd.DataFrame: The sheet, with its first row as the header.
+    """
+    processes = processes or os.cpu_count()
+    reader, member = _open_workbook(source_file, sheet_name)
+    with reader.archive as archive:
+        row_offsets, sheet_data_end = _scan_sheet_rows(archive, member)
+        if not row_offsets:
+            return pd.DataFrame()
+        with archive.open(member) as source:
+            prefix = source.read(row_offsets[0])
+    root_tag = _START_TAG.search(prefix).group(1)
+    sheet_data_tag = _SHEET_DATA_START_TAG.search(prefix).group(1)
+    suffix = b"</" + sheet_data_tag + b"></" + root_tag + b">"
+
+    shards = max(1, min(processes, len(row_offsets) // min_shard_rows))
+    bounds = [len(row_offsets) * shard // shards for shard in range(shards)]
+    starts = [row_offsets[bound] for bound in bounds]
+    ends = starts[1:] + [sheet_data_end]
+    arguments = (
+        [source_file] * shards,
+        [sheet_name] * shards,
+        [prefix] * shards,
+        [suffix] * shards,
+        starts,
+        ends,
+        bounds,
+    )
+    if shards == 1:
+        shard_rows = list(map(_read_sheet_shard, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=shards) as executor:
+            shard_rows = list(executor.map(_read_sheet_shard, *arguments))
+
+    # Fill the rows missing from the sheet and drop out of order ones, as
+    # openpyxl does when pandas iterates the sheet
+    data = []
+    for rows in shard_rows:
+        for row_number, row in rows:
+            if row_number > len(data):
+                data.extend([] for _ in range(len(data) + 1, row_number))
+                data.append(row)
+    # Trim trailing empty rows
+    while data and not data[-1]:
+        data.pop()
+    if not data:
+        return pd.DataFrame()
+    # extend rows to max width
+    width = max(len(row) for row in data)
+    data = [row + [""] * (width - len(row)) for row in data]
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+
 def get_seasonal_quarter(date_str: str) -> str:
     """
     Determine the seasonal quarter for a given date.
@@ -63,14 +317,90 @@ def get_seasonal_quarter(date_str: str) -> str:
         return Quarter.Q4.value
 
 
-def get_disbursed_year(date_str: str) -> int:
+class QuarterCalendar:
+    """
+    Precomputed day-of-year lookup of the disbursement year and quarter.
+
+    The payment windows are expanded once into a leap-year table of 366
+    days, holding the index of the quarter the day falls into and the
+    offset to apply to the calendar year. The non-leap table is derived
+    from it by dropping February 29, so windows may start or end on
+    '02-29'. A window
+    whose end is earlier in the year than its start (e.g. Q4 running from
+    October into January) wraps around, and its January days are
+    attributed to the previous year.
+
+    Args:
+        quarters (dict): The payment windows keyed by quarter, with
+                         'payment_start' and 'payment_end' in 'MM-DD'
+                         format. Defaults to QUARTERS.
+    """
+
+    def __init__(self, quarters: dict = QUARTERS):
+        # the trailing None is picked up by days outside of every window
+        self.labels = np.array(list(quarters) + [None], dtype=object)
+        self.quarter_codes = np.full((2, 366), -1, dtype=np.int8)
+        self.year_offsets = np.zeros((2, 366), dtype=np.int8)
+        for code, periods in enumerate(quarters.values()):
+            start = self._day_of_year(
+                LEAP_TEMPLATE_YEAR, periods["payment_start"]
+            )
+            end = self._day_of_year(LEAP_TEMPLATE_YEAR, periods["payment_end"])
+            if start <= end:
+                self.quarter_codes[1, start:end + 1] = code
+            else:
+                self.quarter_codes[1, start:] = code
+                self.quarter_codes[1, :end + 1] = code
+                self.year_offsets[1, :end + 1] = -1
+        # non-leap years skip February 29; their last slot is never used
+        self.quarter_codes[0, :-1] = np.delete(self.quarter_codes[1], LEAP_DAY)
+        self.year_offsets[0, :-1] = np.delete(self.year_offsets[1], LEAP_DAY)
+
+    @staticmethod
+    def _day_of_year(year: int, month_day: str) -> int:
+        """Zero-based day of the year of a 'MM-DD' string."""
+        date = datetime.strptime(f"{year}-{month_day}", "%Y-%m-%d")
+        return date.timetuple().tm_yday - 1
+
+    def lookup(self, date: datetime) -> tuple:
+        """Return the disbursement (year, quarter) of a single date."""
+        leap = int(calendar.isleap(date.year))
+        day = date.timetuple().tm_yday - 1
+        return (
+            date.year + int(self.year_offsets[leap, day]),
+            self.labels[self.quarter_codes[leap, day]],
+        )
+
+    def assign(self, dates: pd.Series) -> tuple:
+        """Return the disbursement year and quarter Series of a datetime
+        Series, using one array lookup per column. Missing dates get a
+        missing year and the None quarter."""
+        missing = dates.isna().to_numpy()
+        leap = dates.dt.is_leap_year.to_numpy().astype(np.intp)
+        day = dates.dt.dayofyear.fillna(1).to_numpy().astype(np.intp) - 1
+        codes = np.where(missing, -1, self.quarter_codes[leap, day])
+        years = pd.Series(
+            dates.dt.year.fillna(0).to_numpy().astype(np.int64)
+            + self.year_offsets[leap, day],
+            index=dates.index,
+        )
+        return (
+            years.mask(missing),
+            pd.Series(self.labels.take(codes), index=dates.index),
+        )
+
+
+DISBURSED_QUARTER_CALENDAR = QuarterCalendar()
+
+
+def get_disbursed_year(
+    date_str: str,
+    quarter_calendar: QuarterCalendar = DISBURSED_QUARTER_CALENDAR,
+) -> int:
     """Get the year of the disbursement based on the date of
     the disbursement."""
     date = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-    if date.month == 1 and date.day < 29:
-        return date.year - 1
-    else:
-        return date.year
+    return quarter_calendar.lookup(date)[0]
 
 
 def get_year(date_str: str) -> int:
@@ -81,55 +411,63 @@ def get_year(date_str: str) -> int:
 # The function that determines from when the disbursement is from
 
 
-def get_disbursed_quarter(date_str: str) -> str:
+def get_disbursed_quarter(
+    date_str: str,
+    quarter_calendar: QuarterCalendar = DISBURSED_QUARTER_CALENDAR,
+) -> str:
     """Get the quarter of the year based on the date of the disbursement."""
     # assume the date time appeared in the sample payment excel file
     # is all in the timezone of Australia/Sydney
     date_time = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-    year = date_time.year
-    for quarter, periods in QUARTERS.items():
-        # handle the special case of Q4 to have correct year for payment
-        # start and end
-        if quarter == "Q4":
-            if date_time.month == 1 and date_time.day < 29:
-                # handle payment start time between Jan 1 and Jan 28
-                payment_start = datetime.strptime(
-                    f"{year-1}-{periods['payment_start']}", "%Y-%m-%d"
-                )
-                # handle payment end time between Jan 1 and Jan 28
-                payment_end = datetime.strptime(
-                    f"{year}-{periods['payment_end']}", "%Y-%m-%d"
-                )
-            else:
-                # handle payment end time between October to December
-                payment_start = datetime.strptime(
-                    f"{year}-{periods['payment_start']}", "%Y-%m-%d"
-                )
-                payment_end = datetime.strptime(
-                    f"{year+1}-{periods['payment_end']}", "%Y-%m-%d"
-                )
-        else:
-            payment_start = datetime.strptime(
-                f"{year}-{periods['payment_start']}", "%Y-%m-%d"
-            )
-            payment_end = datetime.strptime(
-                f"{year}-{periods['payment_end']}", "%Y-%m-%d"
-            )
-        print(
-            "time: ",
-            datetime.strptime(date_time.strftime("%Y-%m-%d"), "%Y-%m-%d"),
+    return quarter_calendar.lookup(date_time)[1]
+
+
+def get_super_rates(
+    dates: pd.Series, rate_schedule: dict = SUPER_RATE_SCHEDULE
+) -> pd.Series:
+    """
+    Look up the superannuation rate in effect on each date.
+
+    Args:
+        dates (pd.Series): A datetime Series.
+        rate_schedule (dict): The rates keyed by their effective date in
+                              'YYYY-MM-DD' format. Defaults to
+                              SUPER_RATE_SCHEDULE.
+
+    Returns:
+        pd.Series: The rate of the latest schedule entry effective on or
+        before each date.
+
+    Raises:
+        ValueError: If a date is missing or earlier than every effective
+                    date.
+    """
+    if dates.isna().any():
+        raise ValueError(
+            f"Cannot look up the super rate of {dates.isna().sum()} "
+            "missing dates"
         )
-        if (
-            payment_start
-            <= datetime.strptime(date_time.strftime("%Y-%m-%d"), "%Y-%m-%d")
-            <= payment_end
-        ):
-            return quarter
-    return None
+    effective_dates = pd.to_datetime(list(rate_schedule), format="%Y-%m-%d")
+    order = np.argsort(effective_dates.to_numpy())
+    rates = np.array(list(rate_schedule.values()))[order]
+    positions = (
+        np.searchsorted(
+            effective_dates.to_numpy()[order], dates.to_numpy(), side="right"
+        )
+        - 1
+    )
+    if (positions < 0).any():
+        raise ValueError(
+            f"No super rate is effective before {dates[positions < 0].min()}"
+        )
+    return pd.Series(rates[positions], index=dates.index)
 
 
 def calculate_ote_and_super(
-    payslips: pd.DataFrame, paycodes: pd.DataFrame
+    payslips: pd.DataFrame,
+    paycodes: pd.DataFrame,
+    group_by: list = GROUP_BY_CRITERIA,
+    rate_schedule: dict = SUPER_RATE_SCHEDULE,
 ) -> pd.DataFrame:
     """
     Calculate the Ordinary Time Earnings (OTE) and superannuation payable
@@ -148,6 +486,11 @@ def calculate_ote_and_super(
         paycodes (pd.DataFrame): A DataFrame containing paycode information
                                  used to filter the payslips for OTE payable
                                  amounts.
+        group_by (list): The columns to aggregate by. Defaults to
+                         GROUP_BY_CRITERIA; use TENANT_GROUP_BY_CRITERIA
+                         to aggregate several employers at once.
+        rate_schedule (dict): The superannuation rates keyed by effective
+                              date. Defaults to SUPER_RATE_SCHEDULE.
 
     Returns:
         pd.DataFrame: A DataFrame with columns 'employee_code', 'year',
@@ -155,20 +498,14 @@ def calculate_ote_and_super(
                       representing the aggregated OTE and superannuation
                       payable for each employee per year and quarter.
     """
-    ote_df = filter_ote_payable(payslips, paycodes)
+    ote_df = filter_ote_payable(payslips, paycodes, rate_schedule)
     # Group by EmployeeCode, Year, and Quarter
     ote_grouped = (
-        ote_df.groupby(["employee_code", "year", "quarter"])
+        ote_df.groupby(group_by, observed=True)
         .agg({"amount": "sum", "super_payable": "sum"})
         .reset_index()
     )
-    ote_grouped.columns = [
-        "employee_code",
-        "year",
-        "quarter",
-        "total_ote",
-        "total_super_payable",
-    ]
+    ote_grouped.columns = group_by + ["total_ote", "total_super_payable"]
     return ote_grouped
 
 
@@ -176,44 +513,54 @@ def calculate_ote_and_super(
 
 
 def filter_ote_payable(
-    payslips: pd.DataFrame, paycodes: pd.DataFrame
+    payslips: pd.DataFrame,
+    paycodes: pd.DataFrame,
+    rate_schedule: dict = SUPER_RATE_SCHEDULE,
 ) -> pd.DataFrame:
     """filter the OTE and super payable amount for each
-    employee."""
+    employee. Paycodes carrying an employer_id only apply to the payslips
+    of that employer."""
     # Merge payslips with paycodes to determine if each pay code is OTE
+    tenant_keys = [EMPLOYER_ID] if EMPLOYER_ID in paycodes.columns else []
     merged_df = pd.merge(
-        payslips, paycodes, left_on="code", right_on="pay_code"
+        payslips,
+        paycodes,
+        left_on=tenant_keys + ["code"],
+        right_on=tenant_keys + ["pay_code"],
     )
     ote_df = merged_df[merged_df["ote_treament"] == "OTE"]
-    # Calculate the super payable amount based on the OTE amount and 0.095 rate
-    ote_df["super_payable"] = ote_df["amount"] * OTE_SUPER_RATE
+    # Calculate the super payable amount based on the OTE amount and the
+    # rate in effect when the payslip period ends
+    super_rates = get_super_rates(
+        pd.to_datetime(ote_df["end"], format="%Y-%m-%d"), rate_schedule
+    )
+    ote_df["super_payable"] = ote_df["amount"] * super_rates
     # Get the natural quarter and year of the payslip when the payment ends
     ote_df["quarter"] = ote_df["end"].apply(get_seasonal_quarter)
     ote_df["year"] = ote_df["end"].apply(get_year)
     return ote_df
 
 
-def calculate_disbursed(disbursements: pd.DataFrame) -> pd.DataFrame:
+def calculate_disbursed(
+    disbursements: pd.DataFrame,
+    quarter_calendar: QuarterCalendar = DISBURSED_QUARTER_CALENDAR,
+    group_by: list = GROUP_BY_CRITERIA,
+) -> pd.DataFrame:
     """Calculate the total disbursed amount for each employee per
     year and quarter."""
-    # Get the natural quarter and year of the disbursement
-    disbursements["quarter"] = disbursements["payment_made"].apply(
-        get_disbursed_quarter
+    # Get the disbursement year and quarter from the precomputed calendar
+    payment_made = pd.to_datetime(
+        disbursements["payment_made"], format="%Y-%m-%dT%H:%M:%S"
     )
-    disbursements["year"] = disbursements["payment_made"].apply(
-        get_disbursed_year
+    disbursements["year"], disbursements["quarter"] = quarter_calendar.assign(
+        payment_made
     )
     disbursements_grouped = (
-        disbursements.groupby(["employee_code", "year", "quarter"])
+        disbursements.groupby(group_by, observed=True)
         .agg({"sgc_amount": "sum"})
         .reset_index()
     )
-    disbursements_grouped.columns = [
-        "employee_code",
-        "year",
-        "quarter",
-        "total_disbursed",
-    ]
+    disbursements_grouped.columns = group_by + ["total_disbursed"]
     return disbursements_grouped
 
 
@@ -222,12 +569,15 @@ def calculate_disbursed(disbursements: pd.DataFrame) -> pd.DataFrame:
 
 
 def calculate_variance(
-    ote_super: pd.DataFrame, disbursed: pd.DataFrame
+    ote_super: pd.DataFrame,
+    disbursed: pd.DataFrame,
+    group_by: list = GROUP_BY_CRITERIA,
 ) -> pd.DataFrame:
     # Merge the OTE and super payable DataFrame to calculate the variance
-    merged_df = pd.merge(
-        ote_super, disbursed, on=GROUP_BY_CRITERIA, how="outer"
-    ).fillna(0)
+    merged_df = pd.merge(ote_super, disbursed, on=group_by, how="outer")
+    # Only the amounts are filled, the group_by keys may be categorical
+    value_columns = merged_df.columns.difference(group_by)
+    merged_df.fillna(dict.fromkeys(value_columns, 0), inplace=True)
     merged_df["variance"] = (
         merged_df["total_super_payable"] - merged_df["total_disbursed"]
     )
@@ -235,31 +585,283 @@ def calculate_variance(
     return merged_df
 
 
-def refine_merged_df(merged_df: pd.DataFrame) -> pd.DataFrame:
+def refine_merged_df(
+    merged_df: pd.DataFrame, group_by: list = GROUP_BY_CRITERIA
+) -> pd.DataFrame:
     """Refine the merged DataFrame by selecting the required columns,
-    removing suffixes, rounding the required columns, and sorting the
-    DataFrame by employee_code, year, and quarter."""
+    rounding the required columns, and sorting the DataFrame by the
+    group_by columns (employee_code, year, and quarter by default).
+
+    The sort order is computed once as an indexer, and each selected
+    column is gathered and rounded straight into its output array, so the
+    refined DataFrame is the only copy materialized."""
     # Select the required columns
-    selected_columns = [
-        "employee_code",
-        "year",
-        "quarter",
+    selected_columns = group_by + [
         "total_ote",
         "total_super_payable",
         "total_disbursed",
         "variance",
     ]
-    merged_df = merged_df[selected_columns]
-    # Round the required columns to 4 decimal places using apply function
     columns_to_round = [
         "total_ote",
         "total_super_payable",
         "total_disbursed",
         "variance",
     ]
-    merged_df[columns_to_round] = merged_df[columns_to_round].apply(
-        lambda x: x.round(ROUNDING_PRECISION)
+    # Stable sort indexer by the group_by columns; np.lexsort takes the
+    # primary key last
+    order = np.lexsort(
+        [
+            pd.factorize(merged_df[column], sort=True)[0]
+            for column in reversed(group_by)
+        ]
+    )
+    refined_columns = {}
+    for column in selected_columns:
+        values = merged_df[column].to_numpy()[order]
+        if column in columns_to_round:
+            np.round(values, ROUNDING_PRECISION, out=values)
+        refined_columns[column] = values
+    return pd.DataFrame(
+        refined_columns, index=merged_df.index[order], copy=False
+    )
+
+
+def build_shared_paycodes(paycodes_by_employer: dict) -> pd.DataFrame:
+    """
+    Combine the paycodes of several employers into one lookup table.
+
+    Each employer's paycodes are tagged with its employer_id and exact
+    duplicate rows are dropped. The pay_code and ote_treament columns are
+    stored as categoricals, so every distinct code and treatment string is
+    held once in a dictionary shared by all employers.
+
+    Args:
+        paycodes_by_employer (dict): The paycodes DataFrame of each
+                                     employer, keyed by employer_id.
+
+    Returns:
+        pd.DataFrame: A DataFrame with columns 'employer_id', 'pay_code',
+                      'ote_treament' and any other paycode columns.
+
+    Raises:
+        ValueError: If an employer lists the same pay_code in rows that
+        differ, e.g. with different ote_treament values.
+    """
+    paycodes = pd.concat(
+        paycodes_by_employer, names=[EMPLOYER_ID, None]
+    ).reset_index(level=EMPLOYER_ID)
+    paycodes = paycodes.drop_duplicates(ignore_index=True)
+    conflicts = paycodes.duplicated(subset=[EMPLOYER_ID, "pay_code"])
+    if conflicts.any():
+        raise ValueError(
+            "Conflicting paycodes for (employer_id, pay_code): "
+            + ", ".join(
+                map(
+                    str,
+                    paycodes.loc[
+                        conflicts, [EMPLOYER_ID, "pay_code"]
+                    ].itertuples(index=False, name=None),
+                )
+            )
+        )
+    return paycodes.astype(
+        {
+            EMPLOYER_ID: pd.CategoricalDtype(list(paycodes_by_employer)),
+            "pay_code": "category",
+            "ote_treament": "category",
+        }
+    )
+
+
+def combine_employer_frames(
+    frames_by_employer: dict, shared_paycodes: pd.DataFrame = None
+) -> pd.DataFrame:
+    """Concatenate the payslips or disbursements of several employers,
+    tagging each row with its employer_id. When shared paycodes are given,
+    the payslip codes are encoded against the same categories so the
+    paycode lookup joins on the shared dictionary."""
+    combined = pd.concat(
+        frames_by_employer, names=[EMPLOYER_ID, None]
+    ).reset_index(level=EMPLOYER_ID)
+    combined.reset_index(drop=True, inplace=True)
+    combined[EMPLOYER_ID] = combined[EMPLOYER_ID].astype(
+        pd.CategoricalDtype(list(frames_by_employer))
+    )
+    if shared_paycodes is not None:
+        combined["code"] = combined["code"].astype(
+            shared_paycodes["pay_code"].dtype
+        )
+    return combined
+
+
+def _find_violations(
+    table: str, column: str, check: str, severity: Severity, mask, values
+) -> list:
+    """Summarise the rows flagged by a boolean mask as at most one
+    violation record, with the first few row positions and values."""
+    positions = np.flatnonzero(np.asarray(mask, dtype=bool))
+    if not len(positions):
+        return []
+    examples = positions[:VIOLATION_EXAMPLES]
+    return [
+        {
+            "table": table,
+            "column": column,
+            "check": check,
+            "severity": severity.value,
+            "count": len(positions),
+            "example_rows": ";".join(str(row) for row in examples),
+            "example_values": ";".join(
+                str(value) for value in np.asarray(values)[examples]
+            ),
+        }
+    ]
+
+
+def validate_super_data(
+    payslips: pd.DataFrame,
+    disbursements: pd.DataFrame,
+    paycodes: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Check the extracted super data before calculating the metrics.
+
+    Every check is evaluated over whole columns: required columns, null
+    keys, date formats, non-numeric or negative amounts, payslips ending
+    before the first super rate is effective, pay codes listed with
+    conflicting rows, and payslip codes missing from the paycodes.
+    Negative amounts are warnings since adjustments can be negative;
+    everything else is an error.
+
+    Args:
+        payslips (pd.DataFrame): The payslips to check.
+        disbursements (pd.DataFrame): The disbursements to check.
+        paycodes (pd.DataFrame): The paycodes to check and to look the
+                                 payslip codes up in.
+
+    Returns:
+        pd.DataFrame: One row per failed check with columns 'table',
+                      'column', 'check', 'severity', 'count',
+                      'example_rows' (zero-based row positions) and
+                      'example_values'. Empty when the data is valid.
+    """
+    tables = {
+        "payslips": payslips,
+        "disbursements": disbursements,
+        "paycodes": paycodes,
+    }
+    violations = []
+    for table, df in tables.items():
+        missing_columns = [
+            column
+            for column in REQUIRED_COLUMNS[table]
+            if column not in df.columns
+        ]
+        for column in missing_columns:
+            violations.append(
+                {
+                    "table": table,
+                    "column": column,
+                    "check": "missing_column",
+                    "severity": Severity.ERROR.value,
+                    "count": 1,
+                    "example_rows": "",
+                    "example_values": ";".join(map(str, df.columns)),
+                }
+            )
+        if missing_columns:
+            # the other checks rely on the required columns
+            continue
+        for column in KEY_COLUMNS[table]:
+            violations += _find_violations(
+                table,
+                column,
+                "null_key",
+                Severity.ERROR,
+                df[column].isna(),
+                df[column],
+            )
+        for column, date_format in DATE_FORMATS.get(table, {}).items():
+            dates = pd.to_datetime(
+                df[column], format=date_format, errors="coerce"
+            )
+            violations += _find_violations(
+                table,
+                column,
+                "malformed_date",
+                Severity.ERROR,
+                dates.isna() & df[column].notna(),
+                df[column],
+            )
+        for column in AMOUNT_COLUMNS.get(table, []):
+            amounts = pd.to_numeric(df[column], errors="coerce")
+            violations += _find_violations(
+                table,
+                column,
+                "non_numeric_amount",
+                Severity.ERROR,
+                amounts.isna() & df[column].notna(),
+                df[column],
+            )
+            violations += _find_violations(
+                table,
+                column,
+                "negative_amount",
+                Severity.WARNING,
+                amounts < 0,
+                df[column],
+            )
+    if "end" in payslips.columns:
+        # the super rate is looked up by the payslip end date
+        end_dates = pd.to_datetime(
+            payslips["end"],
+            format=DATE_FORMATS["payslips"]["end"],
+            errors="coerce",
+        )
+        violations += _find_violations(
+            "payslips",
+            "end",
+            "end_before_first_super_rate",
+            Severity.ERROR,
+            end_dates < pd.Timestamp(min(SUPER_RATE_SCHEDULE)),
+            payslips["end"],
+        )
+    if "pay_code" in paycodes.columns:
+        # a code listed in rows that differ has an ambiguous treatment
+        distinct_paycodes = paycodes.drop_duplicates()
+        conflicting_codes = distinct_paycodes.loc[
+            distinct_paycodes.duplicated(subset="pay_code", keep=False),
+            "pay_code",
+        ]
+        violations += _find_violations(
+            "paycodes",
+            "pay_code",
+            "conflicting_pay_code",
+            Severity.ERROR,
+            paycodes["pay_code"].isin(conflicting_codes)
+            & paycodes["pay_code"].notna(),
+            paycodes["pay_code"],
+        )
+    if "code" in payslips.columns and "pay_code" in paycodes.columns:
+        violations += _find_violations(
+            "payslips",
+            "code",
+            "unknown_code",
+            Severity.ERROR,
+            ~payslips["code"].isin(paycodes["pay_code"])
+            & payslips["code"].notna(),
+            payslips["code"],
+        )
+    return pd.DataFrame(
+        violations,
+        columns=[
+            "table",
+            "column",
+            "check",
+            "severity",
+            "count",
+            "example_rows",
+            "example_values",
+        ],
     )
-    # Sort the DataFrame by employee_code, year, and quarter
-    merged_df = merged_df.sort_values(by=["employee_code", "year", "quarter"])
-    return merged_df
@@ -1,10 +1,14 @@
 import pytest
 import luigi
 import os
+import tracemalloc
 import pandas as pd
 from pipeline import (
+    write_metrics,
     ConvertExcelToCSV,
     CalculateMetrics,
+    CalculateTenantMetrics,
+    ValidateExtractedData,
     RAW_DATA_DIR,
     METRICS_DIR,
     METRICS_FILE,
@@ -12,7 +16,10 @@ from pipeline import (
     PAYSLIPS_FILE,
     PAYCODES_FILE,
     EXTRACTED_DATA_DIR,
+    TENANT_METRICS_FILE,
+    VIOLATIONS_FILE,
 )
+import shutil
 from typing import Callable
 
 SAMPLE_EXCEL_FILE = "sample.xlsx"
@@ -88,12 +95,18 @@ def run_luigi():
     return _run
 
 
+@pytest.mark.parametrize("ingest_processes", [1, 2])
 def test_convert_excel_to_csv(
-    run_luigi: Callable[..., None], sample_excel_file: str, temp_directory: str
+    run_luigi: Callable[..., None],
+    sample_excel_file: str,
+    temp_directory: str,
+    ingest_processes: int,
 ):
     """Tests ConvertExcelToCSV task"""
     task = ConvertExcelToCSV(
-        source_file=sample_excel_file, target_directory=temp_directory
+        source_file=sample_excel_file,
+        target_directory=temp_directory,
+        ingest_processes=ingest_processes,
     )
     task.run()
 
@@ -149,9 +162,9 @@ def test_calculate_metrics(
             "year": [2023, 2023, 2023, 2023],
             "quarter": ["Q1", "Q2", "Q3", "Q2"],
             "total_ote": [1000.0, 1500.0, 0.0, 0.0],
-            "total_super_payable": [95.0, 142.5, 0.0, 0.0],
+            "total_super_payable": [105.0, 157.5, 0.0, 0.0],
             "total_disbursed": [100.0, 0.0, 150.0, 200.0],
-            "variance": [-5.0, 142.5, -150.0, -200.0],
+            "variance": [5.0, 157.5, -150.0, -200.0],
         }
     )
     print("Expected metrics: ", expected_metrics)
@@ -174,10 +187,46 @@ def test_calculate_metrics(
         os.remove(
             os.path.join(temp_directory, EXTRACTED_DATA_DIR, PAYCODES_FILE)
         )
+        os.remove(
+            os.path.join(temp_directory, EXTRACTED_DATA_DIR, VIOLATIONS_FILE)
+        )
     else:
         print("File not found.")
 
 
+def test_write_metrics_traces_memory_on_request(
+    temp_directory: str, capsys: pytest.CaptureFixture
+):
+    """Test that write_metrics only traces memory when asked to and leaves
+    a tracer started by the caller running."""
+    merged_df = pd.DataFrame(
+        {
+            "employee_code": [1115],
+            "year": [2023],
+            "quarter": ["Q1"],
+            "total_ote": [1000.0],
+            "total_super_payable": [105.0],
+            "total_disbursed": [100.0],
+            "variance": [5.0],
+        }
+    )
+    metrics_file = os.path.join(temp_directory, METRICS_DIR, METRICS_FILE)
+    write_metrics(merged_df, metrics_file)
+    assert "Peak memory" not in capsys.readouterr().out
+    assert not tracemalloc.is_tracing()
+    write_metrics(merged_df, metrics_file, trace_memory=True)
+    assert "Peak memory during output" in capsys.readouterr().out
+    assert not tracemalloc.is_tracing()
+    tracemalloc.start()
+    try:
+        write_metrics(merged_df, metrics_file, trace_memory=True)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    os.remove(metrics_file)
+    os.remove(metrics_file.replace(".csv", ".xlsx"))
+
+
 def test_calculate_metrics_requires():
     """Test requires() method of CalculateMetrics task."""
     base_path = "/tmp"
@@ -186,9 +235,13 @@ def test_calculate_metrics_requires():
         base_path=base_path, excel_super_data=excel_super_data
     )
     dependency = task.requires()
-    assert isinstance(dependency, ConvertExcelToCSV)
+    assert isinstance(dependency, ValidateExtractedData)
     assert dependency.source_file == f"{base_path}/data/raw/{excel_super_data}"
     assert dependency.target_directory == f"{base_path}/data/extracted"
+    extraction = dependency.requires()
+    assert isinstance(extraction, ConvertExcelToCSV)
+    assert extraction.source_file == dependency.source_file
+    assert extraction.target_directory == dependency.target_directory
 
 
 def test_calculate_metrics_output():
@@ -200,3 +253,121 @@ def test_calculate_metrics_output():
     )
     expected_output_path = f"{base_path}/metrics/metrics.csv"
     assert task.output().path == expected_output_path
+
+
+def test_calculate_tenant_metrics(
+    run_luigi: Callable[..., None],
+    temp_directory: str,
+    paycodes: pd.DataFrame,
+    payslips: pd.DataFrame,
+    disbursements: pd.DataFrame,
+):
+    """Tests CalculateTenantMetrics with two employers whose paycodes
+    treat the same code differently."""
+    employer_paycodes = {
+        "employer_a": paycodes,
+        "employer_b": pd.DataFrame(
+            {"pay_code": ["C1", "C2"], "ote_treament": ["Not OTE", "OTE"]}
+        ),
+    }
+    excel_files = []
+    for employer_id, employer_paycode in employer_paycodes.items():
+        excel_file = f"{employer_id}.xlsx"
+        with pd.ExcelWriter(
+            os.path.join(temp_directory, RAW_DATA_DIR, excel_file)
+        ) as writer:
+            employer_paycode.to_excel(
+                writer,
+                sheet_name=PAYCODES_FILE.replace(".csv", ""),
+                index=False,
+            )
+            disbursements.to_excel(
+                writer,
+                sheet_name=DISBURSEMENTS_FILE.replace(".csv", ""),
+                index=False,
+            )
+            payslips.to_excel(
+                writer,
+                sheet_name=PAYSLIPS_FILE.replace(".csv", ""),
+                index=False,
+            )
+        excel_files.append(excel_file)
+    task = CalculateTenantMetrics(
+        base_path=temp_directory, excel_super_data_files=excel_files
+    )
+    run_luigi(task)
+    metrics_file = os.path.join(
+        temp_directory, METRICS_DIR, TENANT_METRICS_FILE
+    )
+    metrics_df = pd.read_csv(metrics_file)
+    expected_metrics = pd.DataFrame(
+        {
+            "employer_id": ["employer_a"] * 4 + ["employer_b"] * 3,
+            "employee_code": [1115, 1115, 1115, 1118, 1115, 1115, 1118],
+            "year": [2023] * 7,
+            "quarter": ["Q1", "Q2", "Q3", "Q2", "Q1", "Q3", "Q2"],
+            "total_ote": [1000.0, 1500.0, 0.0, 0.0, 0.0, 0.0, 2000.0],
+            "total_super_payable": [105.0, 157.5, 0.0, 0.0, 0.0, 0.0, 210.0],
+            "total_disbursed": [100.0, 0.0, 150.0, 200.0, 100.0, 150.0, 200.0],
+            "variance": [5.0, 157.5, -150.0, -200.0, -100.0, -150.0, 10.0],
+        }
+    )
+    pd.testing.assert_frame_equal(metrics_df, expected_metrics)
+    # remove the files created for reproducibility
+    os.remove(metrics_file)
+    os.remove(metrics_file.replace(".csv", ".xlsx"))
+    for excel_file in excel_files:
+        os.remove(os.path.join(temp_directory, RAW_DATA_DIR, excel_file))
+    for employer_id in employer_paycodes:
+        shutil.rmtree(
+            os.path.join(temp_directory, EXTRACTED_DATA_DIR, employer_id)
+        )
+
+
+def test_calculate_tenant_metrics_duplicate_employer_ids():
+    """Test requires() rejects Excel files sharing the same stem."""
+    task = CalculateTenantMetrics(
+        base_path="/tmp",
+        excel_super_data_files=["employer.xlsx", "other/employer.xls"],
+    )
+    with pytest.raises(ValueError, match="employer"):
+        task.requires()
+
+
+def test_validate_extracted_data_fails_fast(
+    temp_directory: str,
+    paycodes: pd.DataFrame,
+    payslips: pd.DataFrame,
+    disbursements: pd.DataFrame,
+):
+    """Tests ValidateExtractedData stops at the sample when it finds an
+    error and reports it."""
+    extracted_dir = os.path.join(temp_directory, EXTRACTED_DATA_DIR)
+    paycodes.to_csv(os.path.join(extracted_dir, PAYCODES_FILE), index=False)
+    disbursements.to_csv(
+        os.path.join(extracted_dir, DISBURSEMENTS_FILE), index=False
+    )
+    invalid_payslips = pd.concat(
+        [payslips.head(1).assign(code="C9"), payslips] * 2
+    )
+    invalid_payslips.to_csv(
+        os.path.join(extracted_dir, PAYSLIPS_FILE), index=False
+    )
+    task = ValidateExtractedData(
+        source_file="unused.xlsx",
+        target_directory=extracted_dir,
+        sample_rows=2,
+    )
+    with pytest.raises(ValueError):
+        task.run()
+    assert not task.complete()
+    violations = pd.read_csv(task.output().path)
+    # only the sampled rows were checked
+    assert violations[["table", "check", "count"]].values.tolist() == [
+        ["payslips", "unknown_code", 1]
+    ]
+    # the stale CSV files are removed so the next run extracts them again
+    assert not task.requires().complete()
+    for filename in [PAYCODES_FILE, DISBURSEMENTS_FILE, PAYSLIPS_FILE]:
+        assert not os.path.exists(os.path.join(extracted_dir, filename))
+    os.remove(task.output().path)
@@ -1,5 +1,8 @@
 import pytest
+import warnings
 import pandas as pd
+from datetime import datetime, timedelta
+from openpyxl import Workbook
 from pipeline_utils import (
     read_csv,
     calculate_ote_and_super,
@@ -8,6 +11,12 @@ from pipeline_utils import (
     get_disbursed_quarter,
     refine_merged_df,
     get_seasonal_quarter,
+    get_disbursed_year,
+    QuarterCalendar,
+    build_shared_paycodes,
+    get_super_rates,
+    read_excel_sheet_sharded,
+    validate_super_data,
 )
 
 
@@ -22,6 +31,32 @@ Doe,22,Chicago"""
     return file_path
 
 
+@pytest.fixture
+def excel_file(tmp_path):
+    """Workbook with mixed types, sparse columns, a missing row, text
+    with leading zeros and a column without a header."""
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = "Payslips"
+    worksheet.append(["employee_code", "amount", "end", "code", "id"])
+    for i in range(30):
+        if i == 7:
+            continue
+        worksheet.cell(i + 2, 1, 1000 + i)
+        worksheet.cell(i + 2, 2, i * 1.5 if i % 4 else None)
+        if i > 12:
+            worksheet.cell(i + 2, 3, datetime(2023, 1, 1) + timedelta(i))
+        if i > 20:
+            worksheet.cell(i + 2, 4, "C1")
+        # numeric-looking text first, so a shard may hold only those
+        worksheet.cell(i + 2, 5, f"{i:03d}" if i < 10 else f"E{i}")
+    # a value in a column without a header
+    worksheet.cell(5, 7, "x")
+    file_path = tmp_path / "sharded.xlsx"
+    workbook.save(file_path)
+    return file_path
+
+
 @pytest.fixture
 def payslips():
     return pd.DataFrame(
@@ -66,12 +101,43 @@ def test_calculate_ote_and_super(payslips, paycodes):
             "year": [2023, 2023],
             "quarter": ["Q1", "Q2"],
             "total_ote": [1000, 1500],
-            "total_super_payable": [95, 142.5],
+            "total_super_payable": [105, 157.5],
         }
     )
     pd.testing.assert_frame_equal(result, expected)
 
 
+def test_calculate_ote_and_super_across_rate_changes(paycodes):
+    payslips = pd.DataFrame(
+        {
+            "employee_code": ["E1", "E1", "E1", "E1"],
+            "code": ["C1", "C1", "C1", "C1"],
+            "amount": [1000, 1000, 1000, 1000],
+            "end": ["2021-06-30", "2021-07-01", "2025-06-30", "2025-07-01"],
+        }
+    )
+    result = calculate_ote_and_super(payslips, paycodes)
+    assert result["year"].tolist() == [2021, 2021, 2025, 2025]
+    assert result["quarter"].tolist() == ["Q2", "Q3", "Q2", "Q3"]
+    assert result["total_super_payable"].tolist() == pytest.approx(
+        [95, 100, 115, 120]
+    )
+
+
+def test_get_super_rates():
+    dates = pd.Series(pd.to_datetime(["2020-01-01", "2024-06-30"]))
+    rate_schedule = {"2023-07-01": 0.11, "2010-01-01": 0.09}
+    assert get_super_rates(dates, rate_schedule).tolist() == [0.09, 0.11]
+    with pytest.raises(ValueError):
+        get_super_rates(
+            pd.Series(pd.to_datetime(["2009-12-31"])), rate_schedule
+        )
+    with pytest.raises(ValueError, match="missing"):
+        get_super_rates(
+            pd.Series(pd.to_datetime(["2020-01-01", None])), rate_schedule
+        )
+
+
 def test_read_csv(csv_file):
     result = read_csv(csv_file)
     expected = [
@@ -147,6 +213,76 @@ def test_get_disbursed_quarter():
     assert get_disbursed_quarter("2023-01-26T00:00:00") == "Q4"
 
 
+def test_get_disbursed_year():
+    assert get_disbursed_year("2023-01-28T00:00:00") == 2022
+    assert get_disbursed_year("2023-01-29T00:00:00") == 2023
+    assert get_disbursed_year("2023-12-31T00:00:00") == 2023
+    assert get_disbursed_year("2024-02-29T00:00:00") == 2024
+
+
+def test_quarter_calendar_assign():
+    payment_made = pd.Series(
+        pd.to_datetime(
+            [
+                "2024-01-28",
+                "2024-02-29",
+                "2024-10-29",
+                "2024-12-31",
+                "2023-12-31",
+                "2025-04-28",
+            ]
+        )
+    )
+    years, quarters = QuarterCalendar().assign(payment_made)
+    assert years.tolist() == [2023, 2024, 2024, 2024, 2023, 2025]
+    assert quarters.tolist() == ["Q4", "Q1", "Q4", "Q4", "Q4", "Q1"]
+
+
+def test_quarter_calendar_custom_windows():
+    quarter_calendar = QuarterCalendar(
+        {
+            "H1": {"payment_start": "02-01", "payment_end": "07-31"},
+            "H2": {"payment_start": "08-01", "payment_end": "01-15"},
+        }
+    )
+    assert get_disbursed_quarter(
+        "2023-01-10T00:00:00", quarter_calendar
+    ) == "H2"
+    assert get_disbursed_year("2023-01-10T00:00:00", quarter_calendar) == 2022
+    assert get_disbursed_quarter(
+        "2023-03-01T00:00:00", quarter_calendar
+    ) == "H1"
+    # days outside of every window have no quarter
+    assert get_disbursed_quarter(
+        "2023-01-20T00:00:00", quarter_calendar
+    ) is None
+
+
+def test_quarter_calendar_leap_day_windows():
+    quarter_calendar = QuarterCalendar(
+        {
+            "A": {"payment_start": "01-01", "payment_end": "02-29"},
+            "B": {"payment_start": "03-01", "payment_end": "12-31"},
+        }
+    )
+    dates = pd.Series(
+        pd.to_datetime(["2023-02-28", "2023-03-01", "2024-02-29"])
+    )
+    years, quarters = quarter_calendar.assign(dates)
+    assert years.tolist() == [2023, 2023, 2024]
+    assert quarters.tolist() == ["A", "B", "A"]
+
+
+def test_quarter_calendar_assign_missing_dates():
+    dates = pd.Series(pd.to_datetime(["2024-02-29", None]))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        years, quarters = QuarterCalendar().assign(dates)
+    assert years.iloc[0] == 2024
+    assert pd.isna(years.iloc[1])
+    assert quarters.tolist() == ["Q1", None]
+
+
 def test_refine_merged_df():
     merged_df = pd.DataFrame(
         {
@@ -174,6 +310,37 @@ def test_refine_merged_df():
     pd.testing.assert_frame_equal(result, expected)
 
 
+def test_refine_merged_df_sorts_and_rounds():
+    merged_df = pd.DataFrame(
+        {
+            "employee_code": ["E2", "E1", "E1"],
+            "year": [2023, 2024, 2023],
+            "quarter": ["Q1", "Q1", "Q2"],
+            "total_ote": [2000.004, 1000.0, 1500.0],
+            "total_super_payable": [190.0, 95.0, 142.5],
+            "total_disbursed": [250.0, 100.0, 200.0],
+            "variance": [-60.0, -5.0, -57.456],
+            "unused": [1, 2, 3],
+        }
+    )
+    result = refine_merged_df(merged_df)
+    expected = pd.DataFrame(
+        {
+            "employee_code": ["E1", "E1", "E2"],
+            "year": [2023, 2024, 2023],
+            "quarter": ["Q2", "Q1", "Q1"],
+            "total_ote": [1500.0, 1000.0, 2000.0],
+            "total_super_payable": [142.5, 95.0, 190.0],
+            "total_disbursed": [200.0, 100.0, 250.0],
+            "variance": [-57.46, -5.0, -60.0],
+        },
+        index=[2, 1, 0],
+    )
+    pd.testing.assert_frame_equal(result, expected)
+    # the input is left untouched
+    assert merged_df["variance"].tolist() == [-60.0, -5.0, -57.456]
+
+
 def test_get_seasonal_quarter():
     assert get_seasonal_quarter("2023-01-15") == "Q1"
     assert get_seasonal_quarter("2023-03-31") == "Q1"
@@ -183,3 +350,98 @@ def test_get_seasonal_quarter():
     assert get_seasonal_quarter("2023-09-30") == "Q3"
     assert get_seasonal_quarter("2023-10-01") == "Q4"
     assert get_seasonal_quarter("2023-12-31") == "Q4"
+
+
+def test_build_shared_paycodes(paycodes):
+    duplicated_paycodes = pd.concat([paycodes, paycodes.head(1)])
+    result = build_shared_paycodes(
+        {"employer_a": duplicated_paycodes, "employer_b": paycodes}
+    )
+    assert result["employer_id"].tolist() == [
+        "employer_a",
+        "employer_a",
+        "employer_b",
+        "employer_b",
+    ]
+    assert result["pay_code"].tolist() == ["C1", "C2", "C1", "C2"]
+    # the code strings are shared by both employers
+    assert result["pay_code"].cat.categories.tolist() == ["C1", "C2"]
+
+
+@pytest.mark.parametrize("min_shard_rows", [3, 5, 11, 40])
+def test_read_excel_sheet_sharded(excel_file, min_shard_rows):
+    result = read_excel_sheet_sharded(
+        excel_file, "Payslips", processes=4, min_shard_rows=min_shard_rows
+    )
+    expected = pd.read_excel(excel_file, sheet_name="Payslips")
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_validate_super_data(payslips, paycodes, disbursements):
+    payslips = payslips.copy()
+    payslips.loc[0, "amount"] = -10
+    payslips.loc[1, "code"] = "C9"
+    payslips.loc[2, "end"] = "2023/05/23"
+    disbursements = disbursements.copy()
+    disbursements.loc[1, "employee_code"] = None
+    result = validate_super_data(payslips, disbursements, paycodes)
+    assert result[
+        ["table", "column", "check", "severity"]
+    ].values.tolist() == [
+        ["payslips", "end", "malformed_date", "error"],
+        ["payslips", "amount", "negative_amount", "warning"],
+        ["disbursements", "employee_code", "null_key", "error"],
+        ["payslips", "code", "unknown_code", "error"],
+    ]
+    assert result["example_rows"].tolist() == ["2", "0", "1", "1"]
+    assert result.loc[0, "example_values"] == "2023/05/23"
+
+
+def test_validate_super_data_missing_column(payslips, paycodes, disbursements):
+    paycodes = paycodes.rename(columns={"ote_treament": "ote_treatment"})
+    result = validate_super_data(payslips, disbursements, paycodes)
+    assert result[["table", "column", "check"]].values.tolist() == [
+        ["paycodes", "ote_treament", "missing_column"]
+    ]
+
+
+def test_validate_super_data_end_before_first_super_rate(
+    payslips, paycodes, disbursements
+):
+    payslips = payslips.copy()
+    payslips.loc[1, "end"] = "2002-06-30"
+    result = validate_super_data(payslips, disbursements, paycodes)
+    assert result[
+        ["table", "column", "check", "severity"]
+    ].values.tolist() == [
+        ["payslips", "end", "end_before_first_super_rate", "error"]
+    ]
+    assert result.loc[0, "example_rows"] == "1"
+
+
+def test_validate_super_data_valid(payslips, paycodes, disbursements):
+    assert validate_super_data(payslips, disbursements, paycodes).empty
+
+
+def test_build_shared_paycodes_conflict(paycodes):
+    conflicting_paycodes = pd.concat(
+        [paycodes, paycodes.head(1).assign(ote_treament="NON-OTE")]
+    )
+    with pytest.raises(ValueError, match="employer_a"):
+        build_shared_paycodes(
+            {"employer_a": conflicting_paycodes, "employer_b": paycodes}
+        )
+
+
+def test_validate_super_data_conflicting_pay_code(
+    payslips, paycodes, disbursements
+):
+    paycodes = pd.concat(
+        [paycodes, paycodes, paycodes.head(1).assign(ote_treament="NON-OTE")],
+        ignore_index=True,
+    )
+    result = validate_super_data(payslips, disbursements, paycodes)
+    assert result[["table", "check", "count"]].values.tolist() == [
+        ["paycodes", "conflicting_pay_code", 3]
+    ]
+    assert result.loc[0, "example_rows"] == "0;2;4"